@@ -26,7 +26,8 @@ def load_merged(data_dir: Path) -> tuple[pd.DataFrame, Path]:
     candidates: Sequence[Path] = [data_dir / "filtered" / "merged_filtered.csv", data_dir / "merged_filtered.csv"]
     for path in candidates:
         if path.exists():
-            return pd.read_csv(path), path
+            # Arrow writes small floats in plain notation; pandas' default parser would drop digits from them.
+            return pd.read_csv(path, float_precision="round_trip"), path
     raise FileNotFoundError("merged_filtered.csv not found in data-dir or data-dir/filtered")
 
 
@@ -37,11 +38,12 @@ def safe_div(numer: pd.Series, denom: pd.Series) -> pd.Series:
 
 def normalize_symbol(series: pd.Series) -> pd.Series:
     out = series.astype(str).str.strip()
-    return out.str.replace(r"\.0$", "", regex=True)
+    return out.str.removesuffix(".0")
 
 
 def load_ocscore(data_dir: Path) -> Optional[DataFrame]:
     candidates = [
+        data_dir / "filtered" / "ocscore_filtered.parquet",
         data_dir / "filtered" / "ocscore_filtered.xlsx",
         data_dir / "filtered" / "ocscore_filtered.csv",
         data_dir / "ocscore.xlsx",
@@ -50,7 +52,9 @@ def load_ocscore(data_dir: Path) -> Optional[DataFrame]:
     for path in candidates:
         if path.exists():
             if path.suffix.lower() == ".csv":
-                return pd.read_csv(path)
+                return pd.read_csv(path, float_precision="round_trip")
+            if path.suffix.lower() == ".parquet":
+                return pd.read_parquet(path)
             return pd.read_excel(path, header=None if path.name == "ocscore.xlsx" else 0)
     return None
 
@@ -2,7 +2,13 @@ import argparse
 from pathlib import Path
 from typing import Dict, Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
+
+from pipeline_utils import downcast_numeric, encode_categoricals, csv_ready, csv_write_options, normalize_code, read_csv_arrow, to_arrow_table
 
 
 PRODUCT_COLUMNS: Sequence[str] = (
@@ -64,6 +70,28 @@ DIV_COLUMNS: Sequence[str] = (
 )
 
 
+# Output metadata column -> merged source columns, first present wins.
+METADATA_SOURCES: Dict[str, Sequence[str]] = {
+    "ShortName_EN": ("mc_pro_ShortName_EN", "mc_degree_ShortName_EN", "cg_co_Stknme_en"),
+    "IndustryCodeC": ("cg_co_Nnindcd", "cg_co_IndustryCodeC"),
+    "IndustryCodeD": ("cg_co_IndustryCodeD",),
+    "IndustryCodeB": ("cg_co_Nindcd",),
+    "IndustryCodeA": ("cg_co_Indcd",),
+    "Stktype": ("cg_co_Stktype",),
+    "ListedDate": ("cg_co_ListedDate",),
+}
+
+
+# Rows per batch when streaming a classified output to disk.
+STREAM_CHUNK_ROWS = 100_000
+
+# (statement type, StateTypeCode value, StatementType label)
+STATEMENT_TYPES: Sequence[Tuple[str, str, str]] = (
+    ("parent", "2", "Parent"),
+    ("consolidated", "1", "Consolidated"),
+)
+
+
 def pick_first(df: pd.DataFrame, candidates: Sequence[str], default: Optional[str] = None) -> Optional[str]:
     for c in candidates:
         if c in df.columns:
@@ -71,141 +99,174 @@ def pick_first(df: pd.DataFrame, candidates: Sequence[str], default: Optional[st
     return default
 
 
-def ensure_cols(df: pd.DataFrame, cols: Sequence[str]) -> pd.DataFrame:
-    for c in cols:
-        if c not in df.columns:
-            df[c] = None
-    return df
-
-
-def normalize_code(series: pd.Series) -> pd.Series:
-    return series.astype(str).str.replace(r"\.0$", "", regex=True)
-
-
 def load_merged(data_dir: Path) -> pd.DataFrame:
     candidates = [data_dir / "filtered" / "merged_filtered.csv", data_dir / "merged_filtered.csv"]
     for p in candidates:
         if p.exists():
-            return pd.read_csv(p)
+            return encode_categoricals(read_csv_arrow(p, arrow_dtypes=True), match_suffix=True)
     raise FileNotFoundError("merged_filtered.csv not found in data-dir or data-dir/filtered")
 
 
-def add_statement_and_filter(df: pd.DataFrame, state_col: str, statement_type: str) -> pd.DataFrame:
-    code = {"parent": "2", "consolidated": "1"}[statement_type]
-    codes = normalize_code(df[state_col])
-    out = df[codes == code].copy()  # Preserve all merged columns
-    out["StatementType"] = "Parent" if statement_type == "parent" else "Consolidated"
-    return out
-
-
-def extract_metadata(df: pd.DataFrame) -> Dict[str, pd.Series]:
-    meta = {}
-    meta["ShortName_EN"] = df.get(pick_first(df, ["mc_pro_ShortName_EN", "mc_degree_ShortName_EN", "cg_co_Stknme_en"]))
-    meta["IndustryCodeC"] = df.get(pick_first(df, ["cg_co_Nnindcd", "cg_co_IndustryCodeC"]))
-    meta["IndustryCodeD"] = df.get("cg_co_IndustryCodeD")
-    meta["IndustryCodeB"] = df.get("cg_co_Nindcd")
-    meta["IndustryCodeA"] = df.get("cg_co_Indcd")
-    meta["Stktype"] = df.get("cg_co_Stktype")
-    meta["ListedDate"] = df.get("cg_co_ListedDate")
-    return meta
-
-
-def build_product_outputs(df: pd.DataFrame, output_dir: Path) -> Tuple[int, int]:
-    meta = extract_metadata(df)
+def extract_metadata(df: pd.DataFrame) -> pd.DataFrame:
+    """Metadata columns under their output names in one selection; absent sources become empty columns."""
+    col_set = set(df.columns)
+    present = {}
+    for out_col, candidates in METADATA_SOURCES.items():
+        src = next((c for c in candidates if c in col_set), None)
+        if src is not None:
+            present[out_col] = src
+    meta = df[list(present.values())].set_axis(list(present), axis=1)
+    return meta.reindex(columns=list(METADATA_SOURCES))
+
+
+def statement_masks(state_codes: np.ndarray) -> Dict[str, np.ndarray]:
+    return {st_type: state_codes == code for st_type, code, _ in STATEMENT_TYPES}
+
+
+def stream_statement_subset(
+    table: pa.Table,
+    mask: np.ndarray,
+    col_idx: np.ndarray,
+    codes: Dict[str, np.ndarray],
+    label: str,
+    path: Path,
+) -> int:
+    """Write the masked rows of table, with normalized codes and a constant StatementType, in STREAM_CHUNK_ROWS batches."""
+    rows = np.flatnonzero(mask)
+    table = table.select([int(i) for i in col_idx])
+    names = table.column_names
+    # Code columns and StatementType are replaced per batch; give them a fixed string type up front.
+    replaced = {names.index(col): values for col, values in codes.items()}
+    replaced[names.index("StatementType")] = None
+    schema = table.schema
+    for i in replaced:
+        schema = schema.set(i, pa.field(names[i], pa.string()))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".parquet":
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    else:
+        writer = pacsv.CSVWriter(path, schema, write_options=csv_write_options(table))
+    with writer:
+        for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+            chunk = rows[start : start + STREAM_CHUNK_ROWS]
+            batch = table.take(chunk)
+            for i, values in replaced.items():
+                chunk_values = np.full(len(chunk), label, dtype=object) if values is None else values[chunk]
+                batch = batch.set_column(i, schema.field(i), pa.array(chunk_values, type=pa.string(), from_pandas=True))
+            writer.write_table(batch)
+    return len(rows)
+
+
+def build_all_outputs(df: pd.DataFrame, output_dir: Path, fmt: str = "csv") -> Dict[str, int]:
+    """Write the two product and four diversification outputs from one shared frame.
+
+    Each StateTypeCode/ClassificationStandard column is normalized once and every output is a row
+    selection over the same base frame. Returns row counts keyed by output file stem.
+    """
     date_col = pick_first(df, ["Date", "EndDate", "Accper"])
     if date_col is None:
         raise KeyError("No date column (Date/EndDate/Accper) found in merged file")
-
-    state_col = pick_first(df, ["mc_pro_StateTypeCode", "StateTypeCode"])
-    if state_col is None:
+    pro_state_col = pick_first(df, ["mc_pro_StateTypeCode", "StateTypeCode"])
+    if pro_state_col is None:
         raise KeyError("StateTypeCode column not found for product data")
-
-    working = df.copy()
-    if "EndDate" not in working.columns:
-        working["EndDate"] = working[date_col]
-
-    working["StateTypeCode"] = normalize_code(working[state_col])
-    for k, v in meta.items():
-        working[k] = v
-
-    working = ensure_cols(working, PRODUCT_COLUMNS)
-
-    counts = {}
-    for st_type, fname in (("parent", "parent_product.csv"), ("consolidated", "consolidated_product.csv")):
-        subset = add_statement_and_filter(working, "StateTypeCode", st_type)
-        subset = ensure_cols(subset, PRODUCT_COLUMNS)
-        out_path = output_dir / fname
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        subset.to_csv(out_path, index=False)
-        counts[st_type] = len(subset)
-    return counts["parent"], counts["consolidated"]
-
-
-def build_div_outputs(df: pd.DataFrame, output_dir: Path) -> Tuple[int, int, int, int]:
-    meta = extract_metadata(df)
-    date_col = pick_first(df, ["Date", "EndDate", "Accper"])
-    if date_col is None:
-        raise KeyError("No date column (Date/EndDate/Accper) found in merged file")
-    state_col = pick_first(df, ["mc_degree_StateTypeCode", "StateTypeCode"])
+    div_state_col = pick_first(df, ["mc_degree_StateTypeCode", "StateTypeCode"])
     class_col = pick_first(df, ["mc_degree_ClassificationStandard", "ClassificationStandard"])
-    if state_col is None or class_col is None:
+    if div_state_col is None or class_col is None:
         raise KeyError("Missing StateTypeCode or ClassificationStandard for diversification data")
 
-    working = df.copy()
-    if "EndDate" not in working.columns:
-        working["EndDate"] = working[date_col]
-
-    working["ClassificationStandard"] = normalize_code(working[class_col])
-    working["StateTypeCode"] = normalize_code(working[state_col])
-    for k, v in meta.items():
-        working[k] = v
-
-    working = ensure_cols(working, DIV_COLUMNS)
-
-    counts = {}
-    for class_value, tag in (("2", "sales"), ("3", "product")):
-        class_df = working[working["ClassificationStandard"] == class_value].copy()
-        for st_type, fname in (
-            ("parent", f"parent_{tag}_diversification.csv"),
-            ("consolidated", f"consolidated_{tag}_diversification.csv"),
-        ):
-            subset = add_statement_and_filter(class_df, "StateTypeCode", st_type)
-            subset = ensure_cols(subset, DIV_COLUMNS)
-            out_path = output_dir / fname
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            subset.to_csv(out_path, index=False)
-            counts[(tag, st_type)] = len(subset)
-
-    return (
-        counts.get(("product", "parent"), 0),
-        counts.get(("product", "consolidated"), 0),
-        counts.get(("sales", "parent"), 0),
-        counts.get(("sales", "consolidated"), 0),
-    )
+    pro_state = normalize_code(df[pro_state_col]).to_numpy()
+    div_state = normalize_code(df[div_state_col]).to_numpy()
+    class_codes = normalize_code(df[class_col]).to_numpy()
+
+    # Columns added to (or replacing) the merged ones: EndDate, code placeholders, metadata, and the remaining
+    # DIV_COLUMNS (a superset of PRODUCT_COLUMNS). Existing names keep their position, as with df[k] = v.
+    missing = pd.Series(None, index=df.index, dtype=object)
+    extras: Dict[str, pd.Series] = {}
+    if "EndDate" not in df.columns:
+        extras["EndDate"] = df[date_col]
+    for name in ("ClassificationStandard", "StateTypeCode"):
+        if name not in df.columns:
+            extras[name] = missing
+    extras.update(extract_metadata(df).items())
+    for name in DIV_COLUMNS:
+        if name not in df.columns and name not in extras:
+            extras[name] = missing
+
+    # One Arrow table holding every column any output needs, in output order (all merged columns preserved).
+    # df is converted once and the extra columns are set on the Arrow side, so no second pandas copy of the
+    # merged frame is built.
+    table = to_arrow_table(df)
+    extras_table = to_arrow_table(pd.DataFrame(extras, index=df.index))
+    for name in extras:
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, extras_table.column(name))
+        else:
+            table = table.append_column(name, extras_table.column(name))
+    # Regenerate the pandas metadata from a zero-row frame of the same columns so pd.read_parquet restores dtypes.
+    template = {**{c: df[c].iloc[:0] for c in df.columns}, **{c: v.iloc[:0] for c, v in extras.items()}}
+    table = table.replace_schema_metadata(pa.Schema.from_pandas(pd.DataFrame(template), preserve_index=False).metadata)
+    del extras_table
+
+    if fmt == "csv":
+        table = csv_ready(table)
+
+    div_only = set(DIV_COLUMNS) - set(PRODUCT_COLUMNS)
+    names = table.column_names
+    product_idx = np.array([i for i, c in enumerate(names) if c in df.columns or c not in div_only])
+    div_idx = np.arange(len(names))
+
+    # Statement/class masks are computed once per code array and combined per output.
+    pro_masks = statement_masks(pro_state)
+    div_masks = statement_masks(div_state)
+    pro_codes = {"StateTypeCode": pro_state}
+    div_codes = {"ClassificationStandard": class_codes, "StateTypeCode": div_state}
+
+    counts: Dict[str, int] = {}
+    for st_type, _, label in STATEMENT_TYPES:
+        stem = f"{st_type}_product"
+        path = output_dir / f"{stem}.{fmt}"
+        counts[stem] = stream_statement_subset(table, pro_masks[st_type], product_idx, pro_codes, label, path)
+    for class_value, tag in (("3", "product"), ("2", "sales")):
+        class_mask = class_codes == class_value
+        for st_type, _, label in STATEMENT_TYPES:
+            stem = f"{st_type}_{tag}_diversification"
+            path = output_dir / f"{stem}.{fmt}"
+            mask = class_mask & div_masks[st_type]
+            counts[stem] = stream_statement_subset(table, mask, div_idx, div_codes, label, path)
+    return counts
 
 
 def main(argv: Optional[Sequence[str]] = None) -> None:
     parser = argparse.ArgumentParser(description="Generate classification outputs from merged_filtered.csv")
     parser.add_argument("--data-dir", type=Path, default=Path.cwd(), help="Base data directory (looks for filtered/merged_filtered.csv)")
     parser.add_argument("--output-dir", type=Path, default=None, help="Directory to write outputs (default: <data-dir>/filtered/classified)")
+    parser.add_argument(
+        "--format",
+        choices=("csv", "parquet"),
+        default="csv",
+        help="File format for the classified outputs (default: csv).",
+    )
+    parser.add_argument(
+        "--downcast",
+        action="store_true",
+        help="Store float columns as float32 and integers in the smallest type that fits (smaller, slightly less exact output).",
+    )
     args = parser.parse_args(argv)
 
     base_dir = args.data_dir.resolve()
     output_dir = (args.output_dir or (base_dir / "filtered" / "classified")).resolve()
 
     merged = load_merged(base_dir)
+    if args.downcast:
+        merged = downcast_numeric(merged)
 
-    parent_prod, cons_prod = build_product_outputs(merged, output_dir)
-    parent_prod_div, cons_prod_div, parent_sales_div, cons_sales_div = build_div_outputs(merged, output_dir)
+    counts = build_all_outputs(merged, output_dir, fmt=args.format)
 
     print("Source used:", base_dir)
     print("Outputs written to", output_dir)
-    print(f"parent_product.csv rows: {parent_prod}")
-    print(f"consolidated_product.csv rows: {cons_prod}")
-    print(f"parent_product_diversification.csv rows: {parent_prod_div}")
-    print(f"consolidated_product_diversification.csv rows: {cons_prod_div}")
-    print(f"parent_sales_diversification.csv rows: {parent_sales_div}")
-    print(f"consolidated_sales_diversification.csv rows: {cons_sales_div}")
+    for stem, rows in counts.items():
+        print(f"{stem}.{args.format} rows: {rows}")
 
 
 if __name__ == "__main__":
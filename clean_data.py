@@ -1,11 +1,20 @@
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence, Set
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
 
+import numpy as np
 import pandas as pd
 
+from pipeline_utils import LOAD_WORKERS, encode_categoricals, normalize_company_id, read_excel_cached, write_table
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; coverage falls back to a pandas groupby
+    njit = None
+
 
 @dataclass
 class DatasetConfig:
@@ -162,13 +171,6 @@ def pick_first_existing(df: pd.DataFrame, columns: Sequence[str]) -> str:
     raise KeyError(f"None of the expected columns are present: {columns}")
 
 
-def normalize_company_id(series: pd.Series) -> pd.Series:
-    # Convert to string, strip spaces, and drop a trailing ".0" from Excel-like numerics.
-    out = series.astype(str).str.strip()
-    out = out.str.replace(r"\.0$", "", regex=True)
-    return out
-
-
 def read_dataset(path: Path, header: int = 0) -> pd.DataFrame:
     if path.suffix.lower() in {".csv"}:
         try:
@@ -176,7 +178,7 @@ def read_dataset(path: Path, header: int = 0) -> pd.DataFrame:
         except pd.errors.ParserError:
             # Retry with the python engine and skipping bad lines to handle irregular CSV rows.
             return pd.read_csv(path, engine="python", on_bad_lines="skip", header=header)
-    return pd.read_excel(path, header=header)
+    return read_excel_cached(path, header=header)
 
 
 def clean_ocscore(df: pd.DataFrame) -> pd.DataFrame:
@@ -236,7 +238,14 @@ def apply_row_filter(df: pd.DataFrame, cfg: DatasetConfig, include_consolidated:
             keep_values.update({"1"})
         if cfg.key in {"fs_combas", "fs_comins", "fs_comscfd", "fs_comscfi", "fn_fn046"}:
             keep_values.update({"A"})
-    filtered = df[df[cfg.filter_col].astype(str).isin(keep_values)]
+    column = df[cfg.filter_col]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Test each category once and look the result up by code; code -1 (missing) never matches.
+        keep_categories = column.cat.categories.astype(str).isin(keep_values)
+        mask = np.append(keep_categories, False)[column.cat.codes.to_numpy()]
+    else:
+        mask = column.astype(str).isin(keep_values)
+    filtered = df[mask]
     return filtered
 
 
@@ -245,7 +254,7 @@ def filter_year_end(df: pd.DataFrame, date_col: Optional[str]) -> pd.DataFrame:
         return df
     dates = pd.to_datetime(df[date_col], errors="coerce")
     mask = (dates.dt.month == 12) & (dates.dt.day == 31)
-    filtered = df.loc[mask].copy()
+    filtered = df.loc[mask]  # boolean selection already materializes a new frame
     return filtered
 
 
@@ -258,68 +267,96 @@ def normalize_year(df: pd.DataFrame, date_col: str) -> pd.Series:
     return dates.dt.year
 
 
+def count_covered_companies(
+    company_codes: np.ndarray,
+    year_codes: np.ndarray,
+    n_companies: int,
+    n_years: int,
+    min_years: int,
+) -> np.ndarray:
+    """Return company codes seen in at least min_years distinct year codes (code -1 = skip the row)."""
+    seen = np.zeros((n_companies, n_years), dtype=np.uint8)
+    for i in range(company_codes.size):
+        c = company_codes[i]
+        y = year_codes[i]
+        if c >= 0 and y >= 0:
+            seen[c, y] = 1
+    counts = np.zeros(n_companies, dtype=np.int64)
+    for c in range(n_companies):
+        for y in range(n_years):
+            counts[c] += seen[c, y]
+    return np.flatnonzero(counts >= min_years)
+
+
+# JIT-compiled when numba is installed: one linear scan with no sort or hash table per company.
+count_covered_companies_jit = njit(cache=True)(count_covered_companies) if njit is not None else None
+
+
 def companies_with_full_years(
-    df: pd.DataFrame,
-    company_col: str,
-    year_col: Optional[str],
+    companies: pd.Series,
+    years: Optional[pd.Series],
     target_years: Set[int],
     min_years: int,
 ) -> Set[str]:
-    temp = df.copy()
-    temp[company_col] = normalize_company_id(temp[company_col])
-    if year_col is None:
-        return set(temp[company_col].dropna().unique())
-    temp["__year"] = normalize_year(temp, year_col)
-    temp = temp.dropna(subset=[company_col, "__year"])
-    year_sets = temp.groupby(company_col)["__year"].apply(lambda s: set(s) & target_years)
-    return {company for company, years in year_sets.items() if len(years) >= min_years}
+    """Companies present in at least min_years of target_years; `companies`/`years` are pre-normalized per row."""
+    if years is None:
+        return set(companies.dropna().unique())
+    if count_covered_companies_jit is not None:
+        company_codes, uniques = pd.factorize(companies)  # missing companies get code -1
+        year_index = pd.Index(sorted(target_years))
+        year_codes = year_index.get_indexer(years)  # years outside target_years (or missing) get -1
+        covered = count_covered_companies_jit(
+            company_codes.astype(np.int64),
+            year_codes.astype(np.int64),
+            len(uniques),
+            len(year_index),
+            min_years,
+        )
+        return set(uniques[covered])
+    keep = companies.notna() & years.isin(target_years)
+    counts = years[keep].groupby(companies[keep]).nunique()
+    return set(counts.index[counts >= min_years])
 
 
 def filter_for_companies_and_years(
     df: pd.DataFrame,
     company_col: str,
-    year_col: Optional[str],
+    companies: pd.Series,
+    years: Optional[pd.Series],
     keep_companies: Set[str],
     target_years: Set[int],
 ) -> pd.DataFrame:
-    out = df.copy()
-    out[company_col] = normalize_company_id(out[company_col])
-    mask = out[company_col].isin(keep_companies)
-    if year_col:
-        out["__year"] = normalize_year(out, year_col)
-        mask &= out["__year"].isin(target_years)
-        out = out.drop(columns=["__year"])
-    return out.loc[mask].reset_index(drop=True)
-
-
-def enforce_min_years_threshold(
-    df: pd.DataFrame,
-    company_col: str,
-    year_col: Optional[str],
-    target_years: Set[int],
-    min_years: int,
-) -> pd.DataFrame:
-    """Keep only companies with at least min_years represented in target_years."""
-    if year_col is None:
-        return df.reset_index(drop=True)
-
-    out = df.copy()
-    out[company_col] = normalize_company_id(out[company_col])
-    out["__year"] = normalize_year(out, year_col)
-    out = out[out["__year"].isin(target_years)]
-
-    counts = out.groupby(company_col)["__year"].nunique()
-    keep_companies = set(counts[counts >= min_years].index)
-    out = out[out[company_col].isin(keep_companies)].drop(columns=["__year"])
+    # Build the mask on the source frame and copy only the surviving rows; `companies` is the normalized company_col.
+    mask = companies.isin(keep_companies)
+    if years is not None:
+        mask &= years.isin(target_years)
+    out = df.loc[mask].copy()
+    out[company_col] = companies[mask].to_numpy()
     return out.reset_index(drop=True)
 
 
 def save_dataset(df: pd.DataFrame, path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    if path.suffix.lower() == ".csv":
-        df.to_csv(path, index=False)
-    else:
-        df.to_excel(path, index=False)
+    # CSV sources stay CSV; everything else is written as Parquet (Excel writes are far slower).
+    if path.suffix.lower() != ".csv":
+        path = path.with_suffix(".parquet")
+    write_table(df, path)
+
+
+def load_dataset(
+    cfg: DatasetConfig, data_dir: Path, include_consolidated: bool = False
+) -> Tuple[Path, pd.DataFrame, str]:
+    """Read one dataset and apply its row and year-end filters; also returns a progress line for the caller."""
+    path = find_input_file(cfg, data_dir)
+    t0 = time.perf_counter()
+    df = read_dataset(path, header=cfg.header)
+    if cfg.key == "ocscore":
+        df = clean_ocscore(df)
+    df = encode_categoricals(df)
+    loaded = f"[clean] loaded {cfg.stem}: rows={len(df)}, cols={df.shape[1]}, elapsed={time.perf_counter() - t0:.1f}s"
+    df = apply_row_filter(df, cfg, include_consolidated=include_consolidated)
+    if cfg.enforce_year_end:
+        df = filter_year_end(df, cfg.date_cols[0] if cfg.date_cols else None)
+    return path, df, loaded
 
 
 def process(
@@ -333,30 +370,27 @@ def process(
     loaded = {}
     metadata = {}
     coverage_sets = []
-    for cfg in DATASETS:
-        print(f"[clean] loading {cfg.stem}...", flush=True)
-        path = find_input_file(cfg, data_dir)
-        t0 = time.perf_counter()
-        df = read_dataset(path, header=cfg.header)
-        if cfg.key == "ocscore":
-            df = clean_ocscore(df)
-        print(
-            f"[clean] loaded {cfg.stem}: rows={len(df)}, cols={df.shape[1]}, "
-            f"elapsed={time.perf_counter() - t0:.1f}s",
-            flush=True,
-        )
-        df = apply_row_filter(df, cfg, include_consolidated=include_consolidated)
-        if cfg.enforce_year_end:
-            df = filter_year_end(df, cfg.date_cols[0] if cfg.date_cols else None)
+    # Files are read LOAD_WORKERS at a time (Excel parsing itself is not parallel: openpyxl holds the GIL). Each
+    # worker filters its frame before starting the next read, so at most LOAD_WORKERS unfiltered frames are alive.
+    # Coverage is computed in DATASETS order as the results come back.
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        futures = [executor.submit(load_dataset, cfg, data_dir, include_consolidated) for cfg in DATASETS]
+    for cfg, future in zip(DATASETS, futures):
+        path, df, loaded_line = future.result()
+        print(loaded_line, flush=True)
         company_col = pick_first_existing(df, cfg.company_cols)
         year_col = pick_first_existing(df, cfg.date_cols) if cfg.date_cols else None
-        loaded[cfg.key] = (cfg, path, df, company_col, year_col)
-        coverage = companies_with_full_years(df, company_col, year_col, target_years, min_years) if cfg.participates_in_coverage else set()
+        # Normalize the company IDs and parse the date column once; coverage, year stats, and the final
+        # filters all reuse them.
+        companies = normalize_company_id(df[company_col])
+        years = normalize_year(df, year_col) if year_col else None
+        loaded[cfg.key] = (cfg, path, df, company_col, companies, years)
+        coverage = companies_with_full_years(companies, years, target_years, min_years) if cfg.participates_in_coverage else set()
         if cfg.participates_in_coverage:
             coverage_sets.append(coverage)
         years_present = None
-        if year_col:
-            years_series = normalize_year(df, year_col).dropna().astype(int)
+        if years is not None:
+            years_series = years.dropna().astype(int)
             years_present = (years_series.min(), years_series.max(), sorted(years_series.unique())[:10])
         metadata[cfg.key] = {
             "path": path,
@@ -393,30 +427,24 @@ def process(
             "Check counts above; likely some files lack the full year range or have mismatched company codes."
         )
 
-    for cfg_key, (cfg, path, df, company_col, year_col) in loaded.items():
+    for cfg_key, (cfg, path, df, company_col, companies, years) in loaded.items():
         if cfg.passthrough:
             filtered = df.reset_index(drop=True)
         elif cfg.participates_in_coverage:
-            filtered = filter_for_companies_and_years(df, company_col, year_col, common_companies, target_years)
+            filtered = filter_for_companies_and_years(df, company_col, companies, years, common_companies, target_years)
         elif cfg.key == "ifs_emp":
             # Industry-level file: filter by years only
-            filtered = df.copy()
-            if year_col:
-                filtered["__year"] = normalize_year(filtered, year_col)
-                filtered = filtered[filtered["__year"].isin(target_years)]
-                filtered = filtered.drop(columns=["__year"])
+            filtered = df if years is None else df.loc[years.isin(target_years)]
             filtered = filtered.reset_index(drop=True)
         else:
-            # Excluded from coverage computation but still aligned to the common companies and target years
-            filtered = filter_for_companies_and_years(df, company_col, year_col, common_companies, target_years)
-            filtered = enforce_min_years_threshold(
-                filtered,
-                company_col=company_col,
-                year_col=year_col,
-                target_years=target_years,
-                min_years=min_years,
+            # Excluded from coverage computation but still aligned to the common companies and target years,
+            # and each kept company must itself meet min_years in this file.
+            own_coverage = companies_with_full_years(companies, years, target_years, min_years)
+            filtered = filter_for_companies_and_years(
+                df, company_col, companies, years, common_companies & own_coverage, target_years
             )
-        output_path = output_dir / f"{path.stem}_filtered{path.suffix}"
+        output_suffix = ".csv" if path.suffix.lower() == ".csv" else ".parquet"
+        output_path = output_dir / f"{path.stem}_filtered{output_suffix}"
         save_dataset(filtered, output_path)
         print(f"Saved filtered {cfg_key} -> {output_path} (rows={len(filtered)})")
 
@@ -1,21 +1,29 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Sequence
+from typing import Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
 
+from pipeline_utils import LOAD_WORKERS, downcast_numeric, encode_categoricals, normalize_company_id, read_csv_arrow, read_excel_cached, write_table
 
-# Utility helpers
+try:
+    import duckdb
+except ImportError:  # duckdb is optional; sources are then joined with sequential pandas merges
+    duckdb = None
 
-def normalize_company_id(series: pd.Series) -> pd.Series:
-    out = series.astype(str).str.strip()
-    return out.str.replace(r"\.0$", "", regex=True)
 
+# Utility helpers
 
 def read_any(path: Path) -> pd.DataFrame:
     if path.suffix.lower() == ".csv":
-        return pd.read_csv(path)
-    return pd.read_excel(path)
+        df = read_csv_arrow(path)
+    elif path.suffix.lower() == ".parquet":
+        df = pd.read_parquet(path, engine="pyarrow")
+    else:
+        df = read_excel_cached(path)
+    return encode_categoricals(df)
 
 
 def ensure_col(df: pd.DataFrame, col: str) -> pd.DataFrame:
@@ -47,9 +55,8 @@ def coerce_numeric_columns(df: pd.DataFrame, group_cols: set) -> tuple[pd.DataFr
 
 def collapse_company_year(df: pd.DataFrame, company_col: str, date_col: str) -> pd.DataFrame:
     """Collapse to one row per company-year using mean for numeric columns and first for others."""
-    temp = df.copy()
-    dates = pd.to_datetime(temp[date_col], errors="coerce")
-    temp = temp.loc[~dates.isna()].copy()
+    dates = pd.to_datetime(df[date_col], errors="coerce")
+    temp = df.loc[~dates.isna()].copy()
     if temp.empty:
         return temp
     temp[company_col] = normalize_company_id(temp[company_col])
@@ -66,11 +73,85 @@ def collapse_company_year(df: pd.DataFrame, company_col: str, date_col: str) ->
 
 
 def build_spine(dfs: Sequence[pd.DataFrame], key_cols: Sequence[str]) -> pd.DataFrame:
-    parts = []
-    for df in dfs:
-        sub = df[list(key_cols)].drop_duplicates()
-        parts.append(sub)
-    return pd.concat(parts, ignore_index=True).drop_duplicates()
+    """Distinct key rows across dfs, in first-seen order (same result as concat + drop_duplicates)."""
+    stacked = pd.concat([df[list(key_cols)] for df in dfs], ignore_index=True)
+    if len(key_cols) != 2:
+        return stacked.drop_duplicates().reset_index(drop=True)
+    # Encode each key column as dense integer codes (missing -> 0) and pack the pair into one uint64,
+    # so deduplication is a single pass over a flat integer array instead of hashing object tuples.
+    first_codes = pd.factorize(stacked[key_cols[0]])[0].astype(np.int64) + 1
+    second_codes = pd.factorize(stacked[key_cols[1]])[0].astype(np.int64) + 1
+    packed = (first_codes.astype(np.uint64) << np.uint64(32)) | second_codes.astype(np.uint64)
+    _, first_seen = np.unique(packed, return_index=True)
+    return stacked.iloc[np.sort(first_seen)].reset_index(drop=True)
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def join_sources(spine: pd.DataFrame, sources: Sequence[Tuple[str, pd.DataFrame, List[str]]]) -> pd.DataFrame:
+    """Left-join each (key, frame, join_cols) source onto the spine; non-key columns are already prefixed.
+
+    With duckdb installed this is one multi-way hash join instead of a chain of pandas merges. Rows are
+    ordered by spine row, then source row, which is the order the sequential left merges produce.
+    """
+    names = list(spine.columns) + [c for _, temp, on in sources for c in temp.columns if c not in on]
+    # DuckDB identifiers are case-insensitive, so names differing only by case must stay on the pandas path.
+    sql_safe = all(isinstance(c, str) for c in names) and len({c.lower() for c in names}) == len(names)
+    if duckdb is None or spine.empty or not sql_safe:
+        # Each merge returns a new frame, so the spine itself never needs copying.
+        merged = spine
+        for _, temp, on in sources:
+            merged = merged.merge(temp, how="left", on=on)
+        return merged
+
+    row_col = "__merge_row"
+    con = duckdb.connect()
+    try:
+        con.register("spine", spine.assign(**{row_col: np.arange(len(spine))}))
+        select = [f"spine.{quote_ident(c)}" for c in spine.columns]
+        joins = []
+        order = [f"spine.{row_col}"]
+        for i, (_, temp, on) in enumerate(sources):
+            alias = f"src{i}"
+            con.register(alias, temp.assign(**{row_col: np.arange(len(temp))}))
+            condition = " AND ".join(f"spine.{quote_ident(c)} = {alias}.{quote_ident(c)}" for c in on)
+            joins.append(f"LEFT JOIN {alias} ON {condition}")
+            select.extend(f"{alias}.{quote_ident(c)}" for c in temp.columns if c not in on)
+            order.append(f"{alias}.{row_col}")
+        query = f"SELECT {', '.join(select)} FROM spine {' '.join(joins)} ORDER BY {', '.join(order)}"
+        return restore_merge_dtypes(con.execute(query).df(), spine, sources)
+    finally:
+        con.close()
+
+
+def restore_merge_dtypes(
+    result: pd.DataFrame, spine: pd.DataFrame, sources: Sequence[Tuple[str, pd.DataFrame, List[str]]]
+) -> pd.DataFrame:
+    """Cast a DuckDB join result to the dtypes the chained pandas merges produce.
+
+    DuckDB hands back ENUMs, nullable Int64/boolean and string columns; the pandas merges keep the input dtypes
+    (run on empty frames below) and only widen integer and bool columns to float64/object where the left join
+    leaves unmatched rows.
+    """
+    expected = spine.head(0)
+    for _, temp, on in sources:
+        expected = expected.merge(temp.head(0), how="left", on=on)
+    for col, dtype in expected.dtypes.items():
+        values = result[col]
+        has_missing = bool(values.isna().any())
+        if has_missing and pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            dtype = np.dtype("float64")
+        elif has_missing and pd.api.types.is_bool_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            dtype = np.dtype(object)
+        if dtype == object:
+            if has_missing or values.dtype != dtype:
+                # DuckDB's None/pd.NA become NaN, as in a pandas merge.
+                result[col] = values.astype(object).where(values.notna(), np.nan)
+        elif values.dtype != dtype:
+            result[col] = values.astype(dtype)
+    return result
 
 
 def assert_source_columns_retained(
@@ -90,43 +171,53 @@ def assert_source_columns_retained(
         )
 
 
-def merge_filtered(data_dir: Path, output_path: Path) -> None:
+def load_source(key: str, path: Path, data_dir: Path) -> Optional[pd.DataFrame]:
+    """Read one filtered source, falling back to legacy/alternate locations; None when no file is found."""
+    if not path.exists() and path.suffix == ".parquet":
+        # Filtered outputs from older clean_data runs were written as Excel.
+        path = path.with_suffix(".xlsx")
+    if path.exists():
+        return read_any(path)
+    alt = list(data_dir.glob(path.name.replace(".xlsx", ".csv")))
+    if alt:
+        return read_any(alt[0])
+    if key == "ifs_emp":
+        # Fall back to unfiltered industry employees file if filtered not present
+        raw = data_dir / "IFS_IndRegMSELE.xlsx"
+        if raw.exists():
+            return read_any(raw)
+    return None
+
+
+def merge_filtered(data_dir: Path, output_path: Path, downcast: bool = False) -> None:
     # Prefer a filtered subfolder if present
     filtered_dir = data_dir / "filtered"
     source_dir = filtered_dir if filtered_dir.exists() else data_dir
 
     # Expected filtered files
     files = {
-        "cg_co": source_dir / "CG_Co_filtered.xlsx",
-        "cg_ybasic": source_dir / "CG_Ybasic_filtered.xlsx",
-        "fs_combas": source_dir / "FS_Combas_filtered.xlsx",
-        "fs_comins": source_dir / "FS_Comins_filtered.xlsx",
-        "fs_comscfd": source_dir / "FS_Comscfd_filtered.xlsx",
-        "fs_comscfi": source_dir / "FS_Comscfi_filtered.xlsx",
-        "fn_fn046": source_dir / "FN_FN046_filtered.xlsx",
+        "cg_co": source_dir / "CG_Co_filtered.parquet",
+        "cg_ybasic": source_dir / "CG_Ybasic_filtered.parquet",
+        "fs_combas": source_dir / "FS_Combas_filtered.parquet",
+        "fs_comins": source_dir / "FS_Comins_filtered.parquet",
+        "fs_comscfd": source_dir / "FS_Comscfd_filtered.parquet",
+        "fs_comscfi": source_dir / "FS_Comscfi_filtered.parquet",
+        "fn_fn046": source_dir / "FN_FN046_filtered.parquet",
         "mc_degree": source_dir / "MC_DiverOperationsDegree_filtered.csv",
         "mc_pro": source_dir / "MC_DiverOperationsPro_filtered.csv",
-        "bdt_fin": source_dir / "BDT_FinDistMertonDD_filtered.xlsx",
-        "ofdi_finindex": source_dir / "OFDI_FININDEX_filtered.xlsx",
-        "ifs_emp": source_dir / "IFS_IndRegMSELE_filtered.xlsx",
+        "bdt_fin": source_dir / "BDT_FinDistMertonDD_filtered.parquet",
+        "ofdi_finindex": source_dir / "OFDI_FININDEX_filtered.parquet",
+        "ifs_emp": source_dir / "IFS_IndRegMSELE_filtered.parquet",
     }
 
-    # Load available files
+    # Load available files concurrently, keeping the files order
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        futures = {key: executor.submit(load_source, key, path, data_dir) for key, path in files.items()}
     dfs: Dict[str, pd.DataFrame] = {}
-    for key, path in files.items():
-        if path.exists():
-            df = read_any(path)
+    for key, future in futures.items():
+        df = future.result()
+        if df is not None:
             dfs[key] = df
-        else:
-            alt = list(data_dir.glob(path.name.replace(".xlsx", ".csv")))
-            if alt:
-                df = read_any(alt[0])
-                dfs[key] = df
-            elif key == "ifs_emp":
-                # Fall back to unfiltered industry employees file if filtered not present
-                raw = data_dir / "IFS_IndRegMSELE.xlsx"
-                if raw.exists():
-                    dfs[key] = read_any(raw)
 
     if not dfs:
         raise FileNotFoundError(f"No filtered files found in {source_dir}")
@@ -161,6 +252,8 @@ def merge_filtered(data_dir: Path, output_path: Path) -> None:
 
         if date_col:
             dfs[key] = collapse_company_year(df, "Symbol", date_col)
+        if downcast:
+            dfs[key] = downcast_numeric(dfs[key])
 
     # Build spine from dated sources (skip industry-level employees which lack Symbol)
     dated_keys = [k for k, col in resolved_date_cols.items() if col and k in dfs and k != "ifs_emp"]
@@ -175,32 +268,29 @@ def merge_filtered(data_dir: Path, output_path: Path) -> None:
         spine_sources.append(df[["Symbol", date_col]].rename(columns={date_col: "Date"}))
     spine = build_spine(spine_sources, ["Symbol", "Date"]) if spine_sources else pd.DataFrame(columns=["Symbol", "Date"])
 
-    # Start merged with spine
-    merged = spine.copy()
-
-    # Join each source
+    # Join each source onto the spine
     # Industry employees handled separately later
-    for key, df in list(dfs.items()):
+    sources = []
+    for key, df in dfs.items():
         if key == "ifs_emp":
             continue
         date_col = resolved_date_cols.get(key)
-        left_on = ["Symbol", "Date"] if date_col else ["Symbol"]
-        right_on = ["Symbol", "Date"] if date_col else ["Symbol"]
-        temp = df.copy()
-        if date_col:
-            temp = temp.rename(columns={date_col: "Date"})
+        on = ["Symbol", "Date"] if date_col else ["Symbol"]
+        temp = df.rename(columns={date_col: "Date"}) if date_col else df
         # Avoid column clashes: prefix all non-key columns with source key
-        key_cols = set(right_on)
-        rename_cols = {c: f"{key}_{c}" for c in temp.columns if c not in key_cols}
+        rename_cols = {c: f"{key}_{c}" for c in temp.columns if c not in on}
         temp = temp.rename(columns=rename_cols)
-        merged = merged.merge(temp, how="left", left_on=left_on, right_on=right_on)
-        assert_source_columns_retained(merged, key, temp, key_cols)
+        sources.append((key, temp, on))
+    merged = join_sources(spine, sources)
+    for key, temp, on in sources:
+        assert_source_columns_retained(merged, key, temp, set(on))
 
     # Optionally enrich with industry-level employees using industry code and year
     if "ifs_emp" in dfs:
-        ind_df = dfs["ifs_emp"].copy()
+        ind_df = dfs["ifs_emp"]
         if "IndustryCode" in ind_df.columns and "SgnYear" in ind_df.columns:
-            merged["__Year"] = pd.to_datetime(merged["Date"], errors="coerce").dt.year.astype("Int64")
+            # Date is already the collapsed integer year; parsing it as a datetime would read it as epoch nanoseconds.
+            merged["__Year"] = pd.to_numeric(merged["Date"], errors="coerce").astype("Int64")
             ind_df["SgnYear"] = pd.to_numeric(ind_df["SgnYear"], errors="coerce").astype("Int64")
             ind_df = ind_df.rename(columns={"LegalEntityNum": "ifs_LegalEntityNum", "EmployeeNum": "ifs_EmployeeNum"})
             merged = merged.merge(
@@ -218,21 +308,28 @@ def merge_filtered(data_dir: Path, output_path: Path) -> None:
     # Ensure serial_number is the first column
     ordered_cols = ["serial_number"] + [c for c in merged.columns if c != "serial_number"]
     merged = merged[ordered_cols]
+    if downcast:
+        # Left joins turn integer columns with unmatched rows into float64; shrink the joined result as well.
+        merged = downcast_numeric(merged)
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    merged.to_csv(output_path, index=False)
+    write_table(merged, output_path)
     print(f"Merged file written to {output_path} (rows={len(merged)})")
 
 
 def main(argv: Optional[Sequence[str]] = None) -> None:
     parser = argparse.ArgumentParser(description="Outer-merge filtered datasets without dropping rows.")
     parser.add_argument("--data-dir", type=Path, default=Path.cwd(), help="Directory containing filtered outputs.")
-    parser.add_argument("--output", type=Path, default=None, help="Output file (default: <data-dir>/filtered/merged_filtered.csv)")
+    parser.add_argument("--output", type=Path, default=None, help="Output file; a .parquet suffix writes Parquet (default: <data-dir>/filtered/merged_filtered.csv)")
+    parser.add_argument(
+        "--downcast",
+        action="store_true",
+        help="Store float columns as float32 and integers in the smallest type that fits (smaller, slightly less exact output).",
+    )
     args = parser.parse_args(argv)
 
     data_dir = args.data_dir.resolve()
     output = args.output or (data_dir / "filtered" / "merged_filtered.csv")
-    merge_filtered(data_dir, output)
+    merge_filtered(data_dir, output, downcast=args.downcast)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+"""Helpers shared by the pipeline scripts (clean_data, merge_filtered, classify_data)."""
+
+import pickle
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
+
+
+# Low-cardinality key/code columns stored as categoricals so filters and joins compare small integer codes.
+CATEGORICAL_COLUMNS: Sequence[str] = (
+    "Symbol",
+    "Stkcd",
+    "StateTypeCode",
+    "ClassificationStandard",
+    "Currency",
+    "Typrep",
+    "IndustryCodeA",
+    "IndustryCodeB",
+    "IndustryCodeC",
+    "IndustryCodeD",
+    "Stktype",
+)
+
+# Threads used to read source files concurrently. openpyxl holds the GIL while parsing, so more threads do not speed
+# up Excel reads; they only keep more unfiltered frames in memory at once.
+LOAD_WORKERS = 2
+
+# pd.read_csv's default missing-value markers.
+PANDAS_NA_VALUES: Sequence[str] = (
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+)
+
+
+def _normalize_codes(series: pd.Series, strip: bool) -> pd.Series:
+    # Convert to string, optionally strip spaces, and drop a trailing ".0" from Excel-like numerics.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Normalize each distinct category once, then broadcast back through the category codes.
+        categories = _normalize_codes(pd.Series(series.cat.categories), strip).to_numpy()
+        values = np.append(categories, np.nan)[series.cat.codes.to_numpy()]  # code -1 (missing) -> NaN
+        return pd.Series(values, index=series.index, name=series.name)
+    # Arrow string kernels run over the whole UTF-8 buffer instead of a per-element regex.
+    arr = pa.array(series.astype(str), type=pa.string())
+    if strip:
+        arr = pc.utf8_trim_whitespace(arr)
+    arr = pc.if_else(pc.ends_with(arr, ".0"), pc.utf8_slice_codeunits(arr, 0, -2), arr)
+    return pd.Series(arr.to_numpy(zero_copy_only=False), index=series.index, name=series.name)
+
+
+def normalize_company_id(series: pd.Series) -> pd.Series:
+    """Company IDs as trimmed strings without a trailing ".0"."""
+    return _normalize_codes(series, strip=True)
+
+
+def normalize_code(series: pd.Series) -> pd.Series:
+    """Code values (StateTypeCode, ClassificationStandard) as strings without a trailing ".0"."""
+    return _normalize_codes(series, strip=False)
+
+
+def encode_categoricals(df: pd.DataFrame, match_suffix: bool = False) -> pd.DataFrame:
+    """Store CATEGORICAL_COLUMNS as categoricals.
+
+    With `match_suffix`, source-prefixed names (e.g. mc_pro_StateTypeCode in the merged file) match too.
+    """
+    for col in df.columns:
+        if col in CATEGORICAL_COLUMNS or (match_suffix and any(col.endswith(f"_{name}") for name in CATEGORICAL_COLUMNS)):
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+    return df
+
+
+def read_excel_cached(path: Path, header: int = 0) -> pd.DataFrame:
+    """Read an Excel file, reusing a cache written next to it on the first read.
+
+    The cache is `<name>.parquet` (e.g. CG_Co.xlsx.parquet), or `<name>.pkl` for workbooks Parquet cannot store
+    losslessly, such as CSMAR exports whose description rows put text above numbers in the same column.
+    """
+    if header != 0:
+        # The cache stores a single parsed layout; only the default header row is cached.
+        return pd.read_excel(path, header=header)
+    # Keep the workbook's suffix in the cache name so it cannot collide with a real `<stem>.parquet` file, such as
+    # clean_data's `X_filtered.parquet` output next to a legacy `X_filtered.xlsx`.
+    parquet_path = path.with_name(path.name + ".parquet")
+    pickle_path = path.with_name(path.name + ".pkl")
+    for cache_path, read in ((parquet_path, pd.read_parquet), (pickle_path, pd.read_pickle)):
+        if cache_path.exists() and cache_path.stat().st_mtime >= path.stat().st_mtime:
+            try:
+                return read(cache_path)
+            except (OSError, ValueError, TypeError, AttributeError, ImportError, EOFError, pickle.UnpicklingError):
+                pass  # Unreadable cache (or a pickle from another pandas version); fall back to parsing the workbook.
+    df = pd.read_excel(path, header=header)
+    try:
+        try:
+            df.to_parquet(parquet_path, engine="pyarrow", compression="zstd", index=False)
+            pickle_path.unlink(missing_ok=True)
+        except (ValueError, TypeError):
+            # Columns mixing numbers and text (or non-string column names): pickle keeps each value's type.
+            parquet_path.unlink(missing_ok=True)
+            df.to_pickle(pickle_path)
+    except OSError as exc:
+        # Read-only directory or full disk: every run re-parses the workbook.
+        print(f"[cache] not caching {path.name}: {exc}", flush=True)
+    return df
+
+
+def read_csv_arrow(path: Path, arrow_dtypes: bool = False) -> pd.DataFrame:
+    """Read a CSV with pyarrow's multithreaded reader, giving the same columns and values as pd.read_csv.
+
+    Columns come back NumPy-backed by default; `arrow_dtypes=True` keeps them Arrow-backed (pd.ArrowDtype).
+    """
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=64 << 20)
+    # Match pandas: its default missing-value markers (empty cells included) are nulls in every column.
+    convert_options = pacsv.ConvertOptions(null_values=sorted(PANDAS_NA_VALUES), strings_can_be_null=True)
+    try:
+        # Column names and types are inferred from the first block, as the full read does.
+        with pacsv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+            schema = reader.schema
+        names = schema.names
+        if len(set(names)) != len(names) or "" in names:
+            # pandas renames repeated headers (EndDate, EndDate.1) and blank ones (Unnamed: 3); callers rely on that.
+            return pd.read_csv(path)
+        # pandas keeps date/time text as strings; Arrow would parse it.
+        convert_options.column_types = {f.name: pa.string() for f in schema if pa.types.is_temporal(f.type)}
+        table = pacsv.read_csv(path, read_options=read_options, convert_options=convert_options)
+    except ValueError:
+        # pyarrow.ArrowInvalid (ragged rows, bad encoding): defer to pandas' more lenient parser.
+        return pd.read_csv(path)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type) and table.num_rows:
+            # All-missing columns are float NaN in pandas, not object None (header-only files stay object).
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    if arrow_dtypes:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Excel columns can mix numbers and text; store those as text (missing values stay missing).
+        fixed = df.copy()
+        for col in fixed.columns[fixed.dtypes == object]:
+            values = fixed[col]
+            fixed[col] = values.where(values.isna(), values.astype(str))
+        return pa.Table.from_pandas(fixed, preserve_index=False)
+
+
+def csv_ready(table: pa.Table) -> pa.Table:
+    """Convert columns whose Arrow CSV text would differ from pandas' to_csv output.
+
+    Midnight-only timestamps become dates ("2001-01-05"), whole-second timestamps become "%Y-%m-%d %H:%M:%S"
+    text, and booleans become "True"/"False".
+    """
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_timestamp(field.type) and field.type.tz is None:
+            if pc.all(pc.equal(pc.floor_temporal(column, unit="day"), column)).as_py() is not False:
+                table = table.set_column(i, field.name, pc.cast(column, pa.date32()))
+            elif pc.all(pc.equal(pc.floor_temporal(column, unit="second"), column)).as_py() is not False:
+                table = table.set_column(i, field.name, pc.strftime(column, format="%Y-%m-%d %H:%M:%S"))
+        elif pa.types.is_boolean(field.type):
+            table = table.set_column(i, field.name, pc.if_else(column, "True", "False"))
+    return table
+
+
+def _needs_quoting(values) -> bool:
+    return any(len(v) and pc.any(pc.match_substring_regex(v, r'[",\r\n]')).as_py() for v in values)
+
+
+def csv_write_options(table: pa.Table) -> pacsv.WriteOptions:
+    """Quote like pandas' to_csv where Arrow allows it.
+
+    Arrow's "needed" style quotes every string value and column name, while pandas only quotes values holding a
+    delimiter, quote or line break. Quoting is turned off unless some value (or name) actually needs it.
+    """
+    values_need_quoting = False
+    for column in table.columns:
+        value_type = column.type.value_type if pa.types.is_dictionary(column.type) else column.type
+        if not (pa.types.is_string(value_type) or pa.types.is_large_string(value_type)):
+            continue
+        chunks = [c.dictionary for c in column.chunks] if pa.types.is_dictionary(column.type) else column.chunks
+        if _needs_quoting(chunks):
+            values_need_quoting = True
+            break
+    names_need_quoting = _needs_quoting([pa.array(table.column_names, type=pa.string())])
+    return pacsv.WriteOptions(
+        quoting_style="needed" if values_need_quoting else "none",
+        quoting_header="needed" if names_need_quoting else "none",
+    )
+
+
+def write_table(df: pd.DataFrame, path: Path) -> None:
+    """Write CSV with pyarrow's multithreaded writer, or Parquet when the path ends in .parquet."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = to_arrow_table(df)
+    if path.suffix.lower() == ".parquet":
+        pq.write_table(table, path, compression="zstd")
+    else:
+        table = csv_ready(table)
+        pacsv.write_csv(table, path, csv_write_options(table))
+
+
+def downcast_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink float columns to float32 and integer columns to the smallest integer type that holds their values."""
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+            continue
+        if pd.api.types.is_float_dtype(dtype):
+            # Unconditional cast (pd.to_numeric's downcast keeps float64 unless every value survives float32).
+            if isinstance(dtype, pd.ArrowDtype):
+                df[col] = df[col].astype(pd.ArrowDtype(pa.float32()))
+            elif isinstance(dtype, pd.Float64Dtype):
+                df[col] = df[col].astype("Float32")
+            else:
+                df[col] = df[col].astype("float32")
+        elif pd.api.types.is_integer_dtype(dtype):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
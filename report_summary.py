@@ -3,6 +3,13 @@ from pathlib import Path
 from typing import Dict, Optional, Sequence, Tuple
 
 import pandas as pd
+import pyarrow.parquet as pq
+
+
+ID_COLUMNS: Sequence[str] = ("Symbol", "Stkcd", "Stkcd.1")
+DATE_COLUMNS: Sequence[str] = ("Date", "Accper", "EndDate", "Enddate", "Reptdt")
+# Merged-file columns the report reads besides the ocscore_* block.
+MERGED_COLUMNS: Sequence[str] = ("Symbol", "Date", "mc_pro_StateTypeCode", "mc_degree_StateTypeCode", "StateTypeCode")
 
 
 def load_merged(data_dir: Path) -> Path:
@@ -14,14 +21,14 @@ def load_merged(data_dir: Path) -> Path:
 
 
 def detect_id_col(df: pd.DataFrame) -> Optional[str]:
-    for c in ("Symbol", "Stkcd", "Stkcd.1"):
+    for c in ID_COLUMNS:
         if c in df.columns:
             return c
     return None
 
 
 def detect_date_col(df: pd.DataFrame) -> Optional[str]:
-    for c in ("Date", "Accper", "EndDate", "Enddate", "Reptdt"):
+    for c in DATE_COLUMNS:
         if c in df.columns:
             return c
     return None
@@ -49,24 +56,37 @@ def summarize_years(df: pd.DataFrame, date_col: str) -> Optional[Tuple[int, int,
 
 def normalize_symbol(series: pd.Series) -> pd.Series:
     out = series.astype(str).str.strip()
-    return out.replace({"nan": pd.NA}).str.replace(r"\.0$", "", regex=True)
+    return out.replace({"nan": pd.NA}).str.removesuffix(".0")
+
+
+def read_columns(path: Path, wanted: Sequence[str]) -> pd.DataFrame:
+    """Read just the `wanted` columns of a CSV/Parquet file (Excel files are read whole)."""
+    # With none of them present every column is read, so the row count is still right.
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        names = pd.read_csv(path, nrows=0).columns
+        return pd.read_csv(path, usecols=[c for c in names if c in wanted] or None, float_precision="round_trip")
+    if suffix == ".parquet":
+        names = pq.read_schema(path).names
+        return pd.read_parquet(path, columns=[c for c in names if c in wanted] or None)
+    return pd.read_excel(path)
 
 
 def summarize_filtered_sources(filtered_dir: Path) -> Dict[str, Dict[str, object]]:
     files = {
-        "cg_co": filtered_dir / "CG_Co_filtered.xlsx",
-        "cg_ybasic": filtered_dir / "CG_Ybasic_filtered.xlsx",
-        "fs_combas": filtered_dir / "FS_Combas_filtered.xlsx",
-        "fs_comins": filtered_dir / "FS_Comins_filtered.xlsx",
-        "fs_comscfd": filtered_dir / "FS_Comscfd_filtered.xlsx",
-        "fs_comscfi": filtered_dir / "FS_Comscfi_filtered.xlsx",
-        "fn_fn046": filtered_dir / "FN_FN046_filtered.xlsx",
+        "cg_co": filtered_dir / "CG_Co_filtered.parquet",
+        "cg_ybasic": filtered_dir / "CG_Ybasic_filtered.parquet",
+        "fs_combas": filtered_dir / "FS_Combas_filtered.parquet",
+        "fs_comins": filtered_dir / "FS_Comins_filtered.parquet",
+        "fs_comscfd": filtered_dir / "FS_Comscfd_filtered.parquet",
+        "fs_comscfi": filtered_dir / "FS_Comscfi_filtered.parquet",
+        "fn_fn046": filtered_dir / "FN_FN046_filtered.parquet",
         "mc_degree": filtered_dir / "MC_DiverOperationsDegree_filtered.csv",
         "mc_pro": filtered_dir / "MC_DiverOperationsPro_filtered.csv",
-        "bdt_fin": filtered_dir / "BDT_FinDistMertonDD_filtered.xlsx",
-        "ofdi_finindex": filtered_dir / "OFDI_FININDEX_filtered.xlsx",
-        "ifs_emp": filtered_dir / "IFS_IndRegMSELE_filtered.xlsx",
-        "ocscore": filtered_dir / "ocscore_filtered.xlsx",
+        "bdt_fin": filtered_dir / "BDT_FinDistMertonDD_filtered.parquet",
+        "ofdi_finindex": filtered_dir / "OFDI_FININDEX_filtered.parquet",
+        "ifs_emp": filtered_dir / "IFS_IndRegMSELE_filtered.parquet",
+        "ocscore": filtered_dir / "ocscore_filtered.parquet",
     }
     friendly = {
         "cg_co": "CG_Co (company metadata)",
@@ -85,14 +105,18 @@ def summarize_filtered_sources(filtered_dir: Path) -> Dict[str, Dict[str, object
     }
     summary: Dict[str, Dict[str, object]] = {}
     for key, path in files.items():
+        if not path.exists() and path.suffix == ".parquet":
+            # Filtered outputs from older clean_data runs were written as Excel.
+            path = path.with_suffix(".xlsx")
         if not path.exists():
             summary[key] = {"exists": False, "label": friendly.get(key, key)}
             continue
-        df = pd.read_excel(path) if path.suffix.lower() != ".csv" else pd.read_csv(path)
+        # Only the id and date columns feed the summary; skip parsing the rest of each file.
+        df = read_columns(path, (*ID_COLUMNS, *DATE_COLUMNS))
         info: Dict[str, object] = {"exists": True, "rows": len(df), "label": friendly.get(key, key)}
         id_col = detect_id_col(df)
         if id_col:
-            info["unique_ids"] = df[id_col].astype(str).str.strip().str.replace(r"\.0$", "", regex=True).nunique()
+            info["unique_ids"] = df[id_col].astype(str).str.strip().str.removesuffix(".0").nunique()
         date_col = detect_date_col(df)
         if date_col:
             yr = summarize_years(df, date_col)
@@ -105,7 +129,9 @@ def summarize_filtered_sources(filtered_dir: Path) -> Dict[str, Dict[str, object
 def build_report(data_dir: Path) -> str:
     filtered_dir = data_dir / "filtered"
     merged_path = load_merged(data_dir)
-    merged_df = pd.read_csv(merged_path)
+    merged_df = pd.read_csv(
+        merged_path, usecols=lambda c: c in MERGED_COLUMNS or c.startswith("ocscore_"), float_precision="round_trip"
+    )
 
     lines = []
     lines.append("Filters applied")